@@ -4,8 +4,12 @@ Add Cities to MongoDB
 Simple script to add multiple cities to your database using just name and country.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from simple_city_fetcher import fetch_and_add_city, setup_collection
-import time
+
+# Lookups are rate limited inside fetch_and_add_city, so extra workers
+# only overlap network and database latency
+MAX_WORKERS = 4
 
 def add_cities():
     """Add a list of cities to MongoDB."""
@@ -29,17 +33,15 @@ def add_cities():
     
     added_count = 0
     
-    for city_name, country in cities_to_add:
-        print(f"\nAdding {city_name}, {country}...")
-        success, message, slug = fetch_and_add_city(city_name, country)
-        print(message)
-        
-        if success:
-            print(f"City slug: {slug}")
-            added_count += 1
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(lambda city: fetch_and_add_city(*city), cities_to_add)
         
-        # Respect Nominatim usage policy - max 1 request per second
-        time.sleep(1)
+        for (city_name, country), (success, message, slug) in zip(cities_to_add, results):
+            print(f"\n{city_name}, {country}: {message}")
+            
+            if success:
+                print(f"City slug: {slug}")
+                added_count += 1
     
     print(f"\nAdded {added_count} out of {len(cities_to_add)} cities.")
     print("You can now use these cities with your data collectors.")
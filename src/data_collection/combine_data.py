@@ -7,32 +7,108 @@ This script combines raw data from MongoDB and creates a processed dataset.
 import os
 import sys
 import argparse
+import hashlib
+import re
 from datetime import datetime
+from types import MappingProxyType
+from functools import partial
+from itertools import chain, islice
+from multiprocessing import Pool
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from mongo_utils import get_database, get_collection
+from pymongo import MongoClient, UpdateOne
+from mongo_utils import (
+    get_database, get_collection, get_raw_places_collection,
+    get_processed_places_collection, drop_collection, bulk_write_unordered
+)
 
 # Load environment variables
 load_dotenv()
 
-def load_data_from_mongodb(city_slug=None, category=None):
-    """Load data from raw_places collection in MongoDB."""
-    collection = get_collection('raw_places')
-    
-    # Build query
+# Shared read-only default for nested lookups on missing sub-documents
+EMPTY_MAPPING = MappingProxyType({})
+
+# Google price levels 0-4 as $ symbols
+PRICE_SYMBOLS = ('', '$', '$$', '$$$', '$$$$')
+
+# Coordinates are compared at 4 decimal places (~11m) when deduplicating
+DEDUP_COORDINATE_PRECISION = 4
+
+# Punctuation and legal suffixes ignored when comparing place names
+NAME_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+NAME_SUFFIX_RE = re.compile(r'\s+(inc|llc|ltd|co|corp|company)$')
+
+# Raw fields read by normalize_google_data; everything else stays on the server
+RAW_PROJECTION = {
+    '_id': 0,
+    'name': 1,
+    'formatted_address': 1,
+    'formatted_phone_number': 1,
+    'website': 1,
+    'rating': 1,
+    'user_ratings_total': 1,
+    'price_level': 1,
+    'geometry.location': 1,
+    'opening_hours.weekday_text': 1,
+    'types': 1,
+    'photos.photo_reference': 1,
+    'place_id': 1,
+    'id': 1,
+    'business_status': 1,
+    'city_slug': 1,
+    'city_name': 1,
+    'state': 1,
+    'state_code': 1,
+    'zip_code': 1,
+    'country': 1
+}
+
+# Number of raw documents fetched per cursor round-trip
+CURSOR_BATCH_SIZE = 1000
+
+# Number of raw documents handed to each worker process at a time
+NORMALIZE_CHUNK_SIZE = 500
+
+# Fields merged into an existing duplicate instead of being set on insert
+MERGED_FIELDS = ('sources', 'updated_at')
+
+# Number of processed documents sent to MongoDB per bulk_write call
+WRITE_BATCH_SIZE = 100
+
+def build_raw_query(city_slug=None, category=None):
+    """Build the raw_places query for the given filters."""
     query = {}
     if city_slug:
         query['city_slug'] = city_slug
     if category:
-        query['category'] = category
+        # Places store every type they were collected for in 'categories'
+        query['categories'] = category
     
     # Only get Google Places data
     query['source'] = 'google'
     
-    return list(collection.find(query))
+    return query
 
-def normalize_google_data(place):
-    """Normalize Google Places data to common format."""
+def load_data_from_mongodb(city_slug=None, category=None):
+    """Return a cursor over matching documents in the raw_places collection."""
+    collection = get_raw_places_collection()
+    query = build_raw_query(city_slug, category)
+    return collection.find(query, RAW_PROJECTION).batch_size(CURSOR_BATCH_SIZE)
+
+def normalize_google_data(place, now=None):
+    """
+    Normalize Google Places data to common format.
+    
+    Args:
+        place (dict): Raw Google Places document.
+        now (datetime, optional): Timestamp for created_at/updated_at, shared
+            across a batch. Defaults to the current time.
+        
+    Returns:
+        dict: Normalized place.
+    """
+    if now is None:
+        now = datetime.now()
+    
     # Extract basic information
     name = place.get('name', '')
     address = place.get('formatted_address', '')
@@ -43,31 +119,37 @@ def normalize_google_data(place):
     price_level = place.get('price_level', 0)
     
     # Convert price level to $ symbols
-    price_symbols = '$' * price_level if price_level else ''
+    price_symbols = PRICE_SYMBOLS[min(price_level, 4)] if price_level else ''
     
     # Get location
-    location = place.get('geometry', {}).get('location', {})
+    geometry = place.get('geometry') or EMPTY_MAPPING
+    location = geometry.get('location') or EMPTY_MAPPING
     coordinates = [location.get('lng', 0), location.get('lat', 0)]
     
     # Get opening hours
-    hours = place.get('opening_hours', {}).get('weekday_text', [])
+    opening_hours = place.get('opening_hours') or EMPTY_MAPPING
+    hours = opening_hours.get('weekday_text') or []
     
     # Get all types/categories
-    types = place.get('types', [])
+    types = place.get('types') or ()
     categories = ', '.join(types)
     
     # Get photos
-    photos = place.get('photos', [])
+    photos = place.get('photos') or ()
     image_url = photos[0].get('photo_reference') if photos else ''
     
     # Get additional details
     place_id = place.get('place_id', '')
     is_closed = place.get('business_status') == 'CLOSED_PERMANENTLY'
     
+    # Stable hash of the duplicate key, persisted for cross-run dedup
+    city_slug = place.get('city_slug', '')
+    dedup_hash = compute_dedup_hash(name, coordinates, city_slug, place.get('id') or place_id)
+    
     return {
         "name": name,
         "address": address,
-        "city_slug": place.get('city_slug', ''),
+        "city_slug": city_slug,
         "city_name": place.get('city_name', ''),
         "state": place.get('state', ''),
         "state_code": place.get('state_code', ''),
@@ -91,66 +173,360 @@ def normalize_google_data(place):
             "google": place_id
         },
         "sources": ["google"],
-        "created_at": datetime.now(),
-        "updated_at": datetime.now()
+        "dedup_hash": dedup_hash,
+        "created_at": now,
+        "updated_at": now
     }
 
-def deduplicate_data(places):
-    """Remove duplicate entries based on name and location."""
-    seen = set()
-    unique_places = []
+def canonical_name(name):
+    """
+    Reduce a place name to the form used for duplicate detection.
+    
+    "Cafe XYZ, Inc." and "cafe xyz" both become "cafe xyz".
+    
+    Args:
+        name (str): Place name.
+        
+    Returns:
+        str: Casefolded name without punctuation or legal suffix.
+    """
+    name = NAME_PUNCTUATION_RE.sub(' ', name.casefold())
+    name = ' '.join(name.split())
+    return NAME_SUFFIX_RE.sub('', name)
+
+def compute_dedup_hash(name, coordinates, city_slug, place_id=''):
+    """
+    Hash the fields that identify a duplicate place.
     
-    for place in places:
-        # Create a unique key based on name and coordinates
-        key = (place['name'], tuple(place['location']['coordinates']))
-        if key not in seen:
-            seen.add(key)
-            unique_places.append(place)
+    Names are canonicalized and coordinates rounded, so near-duplicates
+    of the same place in a city share a hash. Places missing a name or
+    location are keyed by their source ID instead, so they don't all
+    collapse into one.
     
-    return unique_places
+    Args:
+        name (str): Place name.
+        coordinates (list): [longitude, latitude].
+        city_slug (str): City the place was collected for.
+        place_id (str, optional): Source ID of the place.
+        
+    Returns:
+        str: Hex digest shared by all duplicates of the place.
+    """
+    lng, lat = coordinates
+    name = canonical_name(name)
+    if place_id and (not name or (lng, lat) == (0, 0)):
+        key = f"{city_slug}|id|{place_id}"
+    else:
+        key = (
+            f"{city_slug}|{name}|"
+            f"{round(lng, DEDUP_COORDINATE_PRECISION)!r}|"
+            f"{round(lat, DEDUP_COORDINATE_PRECISION)!r}"
+        )
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
 
-def combine_data(city_slug=None, category=None, replace=False):
-    """Combine data from MongoDB raw collections."""
+def build_merge_update(document):
+    """
+    Build the upsert that inserts a normalized place or merges it into an
+    existing duplicate.
+    
+    New places are inserted as-is. For an existing duplicate the server
+    adds any new sources and refreshes updated_at, keeping the first
+    record's fields.
+    
+    Args:
+        document (dict): Normalized place.
+        
+    Returns:
+        UpdateOne: Upsert operation keyed by dedup_hash.
+    """
+    insert_fields = {k: v for k, v in document.items() if k not in MERGED_FIELDS}
+    
+    return UpdateOne(
+        {'dedup_hash': document['dedup_hash']},
+        {
+            '$setOnInsert': insert_fields,
+            '$addToSet': {'sources': {'$each': document['sources']}},
+            '$set': {'updated_at': document['updated_at']}
+        },
+        upsert=True
+    )
+
+def upsert_in_batches(collection, documents, batch_size=WRITE_BATCH_SIZE):
+    """
+    Upsert normalized places by dedup_hash in unordered batches.
+    
+    Duplicates, whether from this run or an earlier one, are merged into
+    the stored document on the server.
+    
+    Args:
+        collection: MongoDB collection to write to.
+        documents (iterable): Normalized documents, consumed lazily.
+        batch_size (int): Number of documents per bulk_write call.
+        
+    Returns:
+        tuple: (inserted_count, merged_count)
+    """
+    inserted_count = 0
+    merged_count = 0
+    operations = []
+    
+    for document in documents:
+        operations.append(build_merge_update(document))
+        if len(operations) >= batch_size:
+            result = bulk_write_unordered(collection, operations)
+            inserted_count += result['nUpserted']
+            merged_count += result['nMatched']
+            operations = []
+    
+    if operations:
+        result = bulk_write_unordered(collection, operations)
+        inserted_count += result['nUpserted']
+        merged_count += result['nMatched']
+    
+    return inserted_count, merged_count
+
+def build_normalize_pipeline(query, now=None):
+    """
+    Build an aggregation pipeline that normalizes, deduplicates and saves
+    Google Places data entirely inside MongoDB.
+    
+    The projection mirrors normalize_google_data. The grouping keys on city,
+    lowercased name and rounded coordinates (or the source ID when the name
+    or location is missing) like compute_dedup_hash, but does not strip
+    punctuation or legal suffixes, and no dedup_hash is stored, so the output
+    must not be merged with places written by combine_data.
+    
+    Args:
+        query (dict): raw_places query to process.
+        now (datetime, optional): Timestamp for created_at/updated_at, in
+            local time like normalize_google_data. Defaults to the current time.
+        
+    Returns:
+        list: Aggregation pipeline stages.
+    """
+    if now is None:
+        now = datetime.now()
+    
+    return [
+        {'$match': query},
+        {'$project': {
+            'name': {'$ifNull': ['$name', '']},
+            'address': {'$ifNull': ['$formatted_address', '']},
+            'city_slug': {'$ifNull': ['$city_slug', '']},
+            'city_name': {'$ifNull': ['$city_name', '']},
+            'state': {'$ifNull': ['$state', '']},
+            'state_code': {'$ifNull': ['$state_code', '']},
+            'zip_code': {'$ifNull': ['$zip_code', '']},
+            'country': {'$ifNull': ['$country', '']},
+            'location': {
+                'type': {'$literal': 'Point'},
+                'coordinates': [
+                    {'$ifNull': ['$geometry.location.lng', 0]},
+                    {'$ifNull': ['$geometry.location.lat', 0]}
+                ]
+            },
+            'phone': {'$ifNull': ['$formatted_phone_number', '']},
+            'website': {'$ifNull': ['$website', '']},
+            'rating': {'$ifNull': ['$rating', 0.0]},
+            'review_count': {'$ifNull': ['$user_ratings_total', 0]},
+            # Convert price level to $ symbols
+            'price_level': {'$ifNull': [
+                {'$arrayElemAt': [
+                    {'$literal': list(PRICE_SYMBOLS)},
+                    {'$min': [{'$ifNull': ['$price_level', 0]}, len(PRICE_SYMBOLS) - 1]}
+                ]},
+                ''
+            ]},
+            'category': {'$ifNull': [{'$arrayElemAt': ['$types', 0]}, '']},
+            # Comma-separated types, same as ', '.join(types)
+            'categories': {'$reduce': {
+                'input': {'$ifNull': ['$types', []]},
+                'initialValue': '',
+                'in': {'$cond': [
+                    {'$eq': ['$$value', '']},
+                    '$$this',
+                    {'$concat': ['$$value', ', ', '$$this']}
+                ]}
+            }},
+            'image_url': {'$ifNull': [{'$arrayElemAt': ['$photos.photo_reference', 0]}, '']},
+            'is_closed': {'$eq': ['$business_status', 'CLOSED_PERMANENTLY']},
+            'hours': {'$ifNull': ['$opening_hours.weekday_text', []]},
+            'source_ids': {'google': {'$ifNull': ['$place_id', '']}},
+            'sources': {'$literal': ['google']},
+            'created_at': {'$literal': now},
+            'updated_at': {'$literal': now},
+            # Only used for grouping, removed before saving
+            'raw_id': {'$ifNull': ['$id', {'$ifNull': ['$place_id', '']}]}
+        }},
+        # Keep the first document for each place in a city
+        {'$group': {
+            '_id': {'$cond': [
+                {'$and': [
+                    {'$ne': ['$raw_id', '']},
+                    {'$or': [
+                        {'$eq': ['$name', '']},
+                        {'$eq': ['$location.coordinates', [0, 0]]}
+                    ]}
+                ]},
+                {'city': '$city_slug', 'id': '$raw_id'},
+                {
+                    'city': '$city_slug',
+                    'name': {'$toLower': '$name'},
+                    'lng': {'$round': [{'$arrayElemAt': ['$location.coordinates', 0]}, DEDUP_COORDINATE_PRECISION]},
+                    'lat': {'$round': [{'$arrayElemAt': ['$location.coordinates', 1]}, DEDUP_COORDINATE_PRECISION]}
+                }
+            ]},
+            'doc': {'$first': '$$ROOT'}
+        }},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+        {'$unset': 'raw_id'},
+        {'$merge': {
+            'into': 'processed_places',
+            'whenMatched': 'merge',
+            'whenNotMatched': 'insert'
+        }}
+    ]
+
+def clear_processed_data(city_slug=None, category=None):
+    """Remove the processed data that is about to be rebuilt."""
+    if city_slug and not category:
+        # Only this city is rebuilt; delete its places and keep the indexes
+        result = get_processed_places_collection().delete_many({'city_slug': city_slug})
+        print(f"Replaced {result.deleted_count} existing processed records for {city_slug}.")
+    else:
+        # Processed places don't record our category slug, so start over
+        drop_collection(get_collection('processed_places'))
+        print("Replaced existing processed data.")
+
+def processed_data_exists(city_slug=None):
+    """Check for processed places in the given city, or anywhere if no city is given."""
+    query = {'city_slug': city_slug} if city_slug else {}
+    return get_processed_places_collection().find_one(query, {'_id': 1}) is not None
+
+def unhashed_data_exists(city_slug=None):
+    """
+    Check for processed places without a dedup_hash, as written by
+    --server-side or by versions of this script before dedup_hash existed.
+    
+    Args:
+        city_slug (str, optional): Only check this city.
+        
+    Returns:
+        bool: True if any such place exists.
+    """
+    collection = get_processed_places_collection()
+    if city_slug:
+        # Bounded by the city_slug index
+        query = {'city_slug': city_slug, 'dedup_hash': None}
+        return collection.find_one(query, {'_id': 1}) is not None
+    
+    # The sparse dedup_hash index can't find missing hashes, but it holds
+    # exactly the hashed places, so compare its size with the collection's
+    hashed = collection.count_documents({'dedup_hash': {'$exists': True}}, hint='dedup_hash_1')
+    return hashed < collection.estimated_document_count()
+
+def combine_data_server_side(city_slug=None, category=None, replace=False):
+    """Combine data from MongoDB raw collections without leaving the server."""
+    if replace:
+        clear_processed_data(city_slug, category)
+    elif processed_data_exists(city_slug):
+        # Without a dedup_hash the pipeline can't recognise existing places
+        print("Error: processed data already exists. Use --replace to rebuild it with --server-side.")
+        return
+    
+    print("Processing raw data inside MongoDB...")
+    collection = get_raw_places_collection()
+    pipeline = build_normalize_pipeline(build_raw_query(city_slug, category))
+    collection.aggregate(pipeline, allowDiskUse=True)
+    print("Merged processed records into MongoDB.")
+
+def normalize_in_pool(pool, normalize, places, workers):
+    """
+    Normalize places in worker processes, one bounded window at a time.
+    
+    Pool.imap would drain the whole cursor into the parent process, so the
+    pool is only given the next window once the previous one is consumed.
+    
+    Args:
+        pool (Pool): Worker processes.
+        normalize (callable): Picklable normalization function.
+        places (iterator): Raw place documents.
+        workers (int): Number of worker processes.
+        
+    Yields:
+        dict: Normalized places, in input order so the first duplicate wins.
+    """
+    window_size = workers * NORMALIZE_CHUNK_SIZE
+    while True:
+        window = list(islice(places, window_size))
+        if not window:
+            break
+        yield from pool.map(normalize, window, chunksize=NORMALIZE_CHUNK_SIZE)
+
+def combine_data(city_slug=None, category=None, replace=False, workers=1):
+    """
+    Combine data from MongoDB raw collections.
+    
+    Args:
+        city_slug (str, optional): Only process this city.
+        category (str, optional): Only process this category.
+        replace (bool): Drop existing processed data first; with only
+            city_slug set, just that city's processed places are deleted.
+        workers (int): Number of processes used for normalization.
+    """
+    if not replace and unhashed_data_exists(city_slug):
+        # Duplicates can only be merged into places that have a dedup_hash
+        print("Error: processed data has places without a dedup_hash, written by --server-side "
+              "or an older version of this script. Use --replace to rebuild it.")
+        return
+    
     print("Loading raw data from MongoDB...")
     raw_data = load_data_from_mongodb(city_slug, category)
     
-    if not raw_data:
+    # Peek at the cursor so an empty result leaves processed data untouched
+    first_place = next(raw_data, None)
+    if first_place is None:
         print("No raw data found in MongoDB.")
         return
     
-    print(f"Processing {len(raw_data)} raw records...")
-    
-    # Normalize data
-    normalized_data = [normalize_google_data(place) for place in raw_data]
+    print("Processing raw records...")
     
-    # Deduplicate
-    unique_data = deduplicate_data(normalized_data)
-    
-    # Save to MongoDB
-    collection = get_collection('processed_places')
+    # Normalize lazily as records stream in from the cursor;
+    # every record in the run shares one timestamp
+    normalize = partial(normalize_google_data, now=datetime.now())
+    places = chain([first_place], raw_data)
     
     if replace:
-        # Drop existing collection and create new one
-        collection.drop()
-        collection = get_collection('processed_places')
-        print("Replaced existing processed data.")
+        clear_processed_data(city_slug, category)
     
-    # Insert new data
-    if unique_data:
-        result = collection.insert_many(unique_data)
-        print(f"Added {len(result.inserted_ids)} processed records to MongoDB.")
+    # Save to MongoDB, deduplicating on dedup_hash
+    collection = get_processed_places_collection()
+    
+    if workers > 1:
+        with Pool(workers) as pool:
+            normalized_data = normalize_in_pool(pool, normalize, places, workers)
+            inserted_count, merged_count = upsert_in_batches(collection, normalized_data)
     else:
-        print("No unique records to add.")
+        inserted_count, merged_count = upsert_in_batches(collection, map(normalize, places))
+    
+    print(f"Added {inserted_count} new processed records to MongoDB, merged {merged_count} duplicates.")
 
 def main():
     parser = argparse.ArgumentParser(description='Combine and process data from Google Places API')
     parser.add_argument('--city-slug', help='Process data for a specific city')
     parser.add_argument('--category', help='Process data for a specific category')
     parser.add_argument('--replace', action='store_true', help='Replace existing processed data')
+    parser.add_argument('--server-side', action='store_true',
+                        help='Normalize and deduplicate inside MongoDB with an aggregation pipeline')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to normalize records')
     
     args = parser.parse_args()
     
-    combine_data(args.city_slug, args.category, args.replace)
+    if args.server_side:
+        combine_data_server_side(args.city_slug, args.category, args.replace)
+    else:
+        combine_data(args.city_slug, args.category, args.replace, args.workers)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -7,11 +7,18 @@ that might be relevant for mental health resources, storing all data in MongoDB.
 
 import os
 import argparse
+import queue
 import requests
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from datetime import datetime
+from itertools import product
 from dotenv import load_dotenv
 from mongo_utils import validate_city, save_raw_places
+from http_utils import create_session, load_json, RateLimiter
 import sys
 import json
 
@@ -24,7 +31,7 @@ SEARCH_ENDPOINT = 'https://places.googleapis.com/v1/places:searchText'
 
 # Valid place types for mental health resources
 # Using hyphen format for slugs instead of underscores
-VALID_PLACE_TYPES = [
+VALID_PLACE_TYPES = (
     'amusement-park',
     'art-gallery',
     'bowling-alley',
@@ -37,11 +44,98 @@ VALID_PLACE_TYPES = [
     'museum',
     'movie-theater',
     'rage-room'
-]
+)
+
+# Effective query templates by place type
+QUERY_TEMPLATES = {
+    'escape-room': "top rated escape rooms in {location}",
+    'rage-room': "rage rooms in {location}",
+    'health': "mental health centers in {location}",
+    'psychologist': "top rated psychologists in {location}",
+    'spa': "best wellness spas in {location}",
+    'gym': "fitness centers in {location}",
+    'park': "relaxing parks in {location}",
+    'museum': "interactive museums in {location}",
+    'movie-theater': "movie theaters in {location}",
+    'bowling-alley': "bowling alleys in {location}",
+    'art-gallery': "interactive art galleries in {location}",
+    'amusement-park': "amusement parks in {location}",
+}
 
 # Updated field mask with only valid fields for the Google Places API v1
 FIELD_MASK = 'places.displayName,places.formattedAddress,places.priceLevel,places.id'
 
+# Shared session so searches reuse the same connection, retrying transient errors;
+# the static headers are set once here instead of on every request
+SESSION = create_session(
+    headers={
+        'Content-Type': 'application/json',
+        'X-Goog-Api-Key': API_KEY or '',
+        'X-Goog-FieldMask': FIELD_MASK
+    },
+    pool_maxsize=32,
+    retries=5
+)
+
+# Searches per second allowed across all workers
+SEARCH_RATE_LIMITER = RateLimiter(rate=float(os.getenv('GOOGLE_PLACES_QPS', '10')), capacity=10)
+
+# Minimum seconds between receiving a page token and requesting its page
+PAGE_TOKEN_DELAY = 2
+
+# Seconds a prefetch thread waits for queue space before checking for a stop
+PREFETCH_POLL_SECONDS = 0.5
+
+# Number of (city, type) pairs collected at the same time
+MAX_WORKERS = 13
+
+# On-disk cache of search responses so re-runs don't spend API quota again
+CACHE_PATH = os.getenv('GOOGLE_PLACES_CACHE_PATH', '.places_cache.sqlite')
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+def open_cache():
+    """Open the search response cache, creating it if needed."""
+    conn = sqlite3.connect(CACHE_PATH)
+    conn.execute('CREATE TABLE IF NOT EXISTS search_pages (key TEXT PRIMARY KEY, body BLOB, fetched_at REAL)')
+    return conn
+
+def read_cached_pages(key):
+    """
+    Get the cached result pages of a search.
+    
+    Args:
+        key (str): Cache key of the search
+        
+    Returns:
+        list: Cached response of each page, or None if missing, older than
+            CACHE_TTL_SECONDS or unreadable
+    """
+    try:
+        with closing(open_cache()) as conn:
+            row = conn.execute('SELECT body, fetched_at FROM search_pages WHERE key = ?', (key,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Warning: could not read search cache: {e}")
+        return None
+    
+    if row and time.time() - row[1] < CACHE_TTL_SECONDS:
+        return load_json(row[0])
+    return None
+
+def write_cached_pages(key, bodies):
+    """Store the response bodies of a search's pages, as received, in the cache."""
+    try:
+        with closing(open_cache()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO search_pages VALUES (?, ?, ?)',
+                         (key, b'[' + b','.join(bodies) + b']', time.time()))
+    except sqlite3.Error as e:
+        # Caching is an optimization; losing a write must not lose the results
+        print(f"Warning: could not write search cache: {e}")
+
+def cached_pages_cover(pages, max_results):
+    """Check whether cached pages hold max_results places or reach the last page."""
+    found = sum(len(page.get('places', ())) for page in pages)
+    return found >= max_results or not pages[-1].get('nextPageToken')
+
 def search_places(query, page_token=None):
     """
     Search for places using Google Places API v1 Text Search.
@@ -51,14 +145,8 @@ def search_places(query, page_token=None):
         page_token (str, optional): Token for pagination
         
     Returns:
-        dict: JSON response from Google Places API
+        bytes: Raw JSON response body from Google Places API, or None on error
     """
-    headers = {
-        'Content-Type': 'application/json',
-        'X-Goog-Api-Key': API_KEY,
-        'X-Goog-FieldMask': FIELD_MASK
-    }
-    
     data = {
         "textQuery": query
     }
@@ -67,64 +155,161 @@ def search_places(query, page_token=None):
         data["pageToken"] = page_token
     
     try:
-        response = requests.post(SEARCH_ENDPOINT, headers=headers, json=data)
+        SEARCH_RATE_LIMITER.acquire()
+        response = SESSION.post(SEARCH_ENDPOINT, json=data)
         response.raise_for_status()
-        return response.json()
+        return response.content
     except requests.exceptions.RequestException as e:
-        print(f"Error searching places: {e}")
+        print(f"Error searching places for '{query}': {e}")
         if hasattr(e, 'response') and e.response:
             print(f"Response status: {e.response.status_code}")
             print(f"Response text: {e.response.text}")
         return None
 
-def collect_data(city, place_type_slug, max_results=60):
+def fetch_place_pages(query, max_results, cache_key):
     """
-    Collect data from Google Places about places in the given location and type.
+    Fetch result pages of a search from the API, starting at the first page.
+    
+    The pages are cached together once the last needed page arrives, so a
+    cached page token is never sent to the API on a later run.
+    
+    Args:
+        query (str): Search query
+        max_results (int): Maximum number of results to fetch
+        cache_key (str): Cache key of the search
+        
+    Yields:
+        dict: JSON response of each page
+    """
+    bodies = []
+    fetched = 0
+    page_token = None
+    
+    while True:
+        if page_token:
+            # Only wait out what's left of the delay after saving the last page
+            remaining = PAGE_TOKEN_DELAY - (time.monotonic() - token_received_at)
+            if remaining > 0:
+                time.sleep(remaining)
+        
+        # Full pages cost the same request and let the cache serve a larger --max;
+        # iter_place_pages trims the last one
+        body = search_places(query, page_token=page_token)
+        if body is None:
+            return
+        
+        results = load_json(body)
+        bodies.append(body)
+        fetched += len(results.get('places', ()))
+        
+        # Check if there are more pages
+        page_token = results.get('nextPageToken')
+        token_received_at = time.monotonic()
+        if not page_token or fetched >= max_results:
+            write_cached_pages(cache_key, bodies)
+            yield results
+            return
+        
+        yield results
+
+def iter_place_pages(city, place_type_slug, max_results=60, use_cache=True):
+    """
+    Fetch pages of places from Google Places for the given location and type.
     
     Args:
         city (dict): City document from MongoDB
         place_type_slug (str): Type of place to search for (hyphenated slug)
         max_results (int): Maximum number of results to collect
+        use_cache (bool): Reuse search results cached by earlier runs
         
-    Returns:
-        list: List of place data dictionaries
+    Yields:
+        list: Place data dictionaries from one results page
     """
-    all_places = []
+    collected = 0
     
     # Construct a search query using one of the effective templates
     query = get_search_query(city, place_type_slug)
+    print(f"Fetching places for '{query}'...")
     
-    page_token = None
+    # Prefix progress lines, since several pairs may be collected at once
+    label = f"[{place_type_slug} in {city['name']}]"
     
-    while len(all_places) < max_results:
-        if page_token:
-            time.sleep(2)  # Rate limiting
-        
-        print(f"Fetching places for '{query}'...")
-        if page_token:
-            print(f"Page token: {page_token[:10]}...")
-        
-        results = search_places(query, page_token=page_token)
-        
-        if not results or 'places' not in results:
-            print(f"No more results found or error in API response")
+    # Replay a cached search only if it has every page this run needs;
+    # otherwise start again from the first page with fresh page tokens
+    cache_key = json.dumps([query, FIELD_MASK])
+    cached_pages = read_cached_pages(cache_key) if use_cache else None
+    if cached_pages and cached_pages_cover(cached_pages, max_results):
+        pages = iter(cached_pages)
+    else:
+        pages = fetch_place_pages(query, max_results, cache_key)
+    
+    for results in pages:
+        if 'places' not in results:
+            print(f"{label} No more results found or error in API response")
             break
         
-        places = results['places']
-        print(f"Found {len(places)} places in this batch")
+        places = results['places'][:max_results - collected]
+        print(f"{label} Found {len(places)} places in this batch")
         
         # Add the category to each place as an array
         for place in places:
             place['categories'] = [place_type_slug]
         
-        all_places.extend(places)
+        collected += len(places)
+        yield places
         
-        # Check if there are more pages
-        page_token = results.get('nextPageToken')
-        if not page_token or len(all_places) >= max_results:
+        if collected >= max_results:
             break
+
+def prefetch(iterable, maxsize=1):
+    """
+    Iterate in a background thread, keeping items ready ahead of the consumer.
+    
+    Args:
+        iterable: Iterable to consume in the background
+        maxsize (int): Maximum number of items fetched ahead
+        
+    Yields:
+        Items of iterable, in order. Errors raised while producing are
+        re-raised in the consumer. If the consumer stops early, the
+        background thread stops too.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+    
+    def put(item):
+        # Wait for room in the queue, unless the consumer has gone away
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
     
-    return all_places[:max_results]
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(done)
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
 
 def get_search_query(city, place_type_slug):
     """
@@ -139,35 +324,19 @@ def get_search_query(city, place_type_slug):
     """
     # Get location from city document
     location = f"{city['name']}, {city['state']}"
-
-    # Dictionary of effective query templates by place type
-    query_templates = {
-        'escape-room': f"top rated escape rooms in {location}",
-        'rage-room': f"rage rooms in {location}",
-        'health': f"mental health centers in {location}",
-        'psychologist': f"top rated psychologists in {location}",
-        'spa': f"best wellness spas in {location}",
-        'gym': f"fitness centers in {location}",
-        'park': f"relaxing parks in {location}",
-        'museum': f"interactive museums in {location}",
-        'movie-theater': f"movie theaters in {location}",
-        'bowling-alley': f"bowling alleys in {location}",
-        'art-gallery': f"interactive art galleries in {location}",
-        'amusement-park': f"amusement parks in {location}",
-    }
     
     # Default template if specific type not found
-    default_template = f"top rated {place_type_slug.replace('-', ' ')} in {location}"
+    default_template = f"top rated {place_type_slug.replace('-', ' ')} in {{location}}"
     
     # Get template for the place type or use default
-    return query_templates.get(place_type_slug, default_template)
+    return QUERY_TEMPLATES.get(place_type_slug, default_template).format(location=location)
 
 def save_data(data, city_slug, place_type_slug):
     """
     Save the collected data to MongoDB.
     
     Args:
-        data (list): List of place data
+        data (iterable): Place data, e.g. one results page or a generator
         city_slug (str): City slug
         place_type_slug (str): Place type slug
         
@@ -175,18 +344,92 @@ def save_data(data, city_slug, place_type_slug):
         tuple: (inserted_count, updated_count)
     """
     # Save to MongoDB
-    inserted_count, updated_count = save_raw_places(data, 'google', city_slug, place_type_slug)
-    print(f"MongoDB: {inserted_count} new records inserted, {updated_count} records updated")
-    return inserted_count, updated_count
+    return save_raw_places(data, 'google', city_slug, place_type_slug)
+
+def collect_one(city, place_type_slug, max_results=60, use_cache=True):
+    """
+    Collect places for one city and type and save them to MongoDB.
+    
+    Args:
+        city (dict): City document from MongoDB
+        place_type_slug (str): Type of place to search for (hyphenated slug)
+        max_results (int): Maximum number of results to collect
+        use_cache (bool): Reuse search responses cached by earlier runs
+        
+    Returns:
+        tuple: (found_count, inserted_count, updated_count)
+    """
+    pages = iter_place_pages(city, place_type_slug, max_results, use_cache)
+    
+    # Save each page to MongoDB while the next one is being fetched; closing
+    # stops the fetch thread right away if saving fails
+    found = inserted = updated = 0
+    with closing(prefetch(pages)) as prefetched:
+        for places in prefetched:
+            page_inserted, page_updated = save_data(places, city['slug'], place_type_slug)
+            found += len(places)
+            inserted += page_inserted
+            updated += page_updated
+    
+    return found, inserted, updated
+
+def collect_many(cities, place_type_slugs, max_results=60, use_cache=True, max_workers=MAX_WORKERS):
+    """
+    Collect every combination of cities and place types concurrently.
+    
+    All workers share the HTTP session, the search rate limiter and the
+    MongoDB connection settings.
+    
+    Args:
+        cities (list): City documents from MongoDB
+        place_type_slugs (list): Types of place to search for (hyphenated slugs)
+        max_results (int): Maximum number of results to collect per pair
+        use_cache (bool): Reuse search responses cached by earlier runs
+        max_workers (int): Number of pairs collected at the same time
+        
+    Returns:
+        tuple: (found_count, inserted_count, updated_count, failed_pairs) over
+            all pairs, where failed_pairs lists the (city_slug, type) pairs
+            that raised an error
+    """
+    found = inserted = updated = 0
+    failed = []
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(collect_one, city, place_type_slug, max_results, use_cache): (city, place_type_slug)
+            for city, place_type_slug in product(cities, place_type_slugs)
+        }
+        
+        for future in as_completed(futures):
+            city, place_type_slug = futures[future]
+            try:
+                pair_found, pair_inserted, pair_updated = future.result()
+            except Exception as e:
+                # Keep the other pairs' results; main reports the failure
+                print(f"Error collecting {place_type_slug} in {city['name']}: {e}")
+                failed.append((city['slug'], place_type_slug))
+                continue
+            print(f"{place_type_slug} in {city['name']}: {pair_found} places, "
+                  f"{pair_inserted} new, {pair_updated} updated")
+            found += pair_found
+            inserted += pair_inserted
+            updated += pair_updated
+    
+    return found, inserted, updated, failed
 
 def main():
     parser = argparse.ArgumentParser(description='Collect data from Google Places API for mental health resources')
-    parser.add_argument('--city-slug', type=str, required=True, 
-                        help='City slug (e.g., "seattle")')
-    parser.add_argument('--type', type=str, required=True, choices=VALID_PLACE_TYPES,
-                        help='Type of place to search for (with hyphens, e.g., "escape-room")')
+    parser.add_argument('--city-slug', type=str, nargs='+', required=True, 
+                        help='One or more city slugs (e.g., "seattle")')
+    parser.add_argument('--type', type=str, nargs='+', required=True, choices=VALID_PLACE_TYPES,
+                        help='One or more types of place to search for (with hyphens, e.g., "escape-room")')
     parser.add_argument('--max', type=int, default=60, 
-                        help='Maximum number of results to collect')
+                        help='Maximum number of results to collect per city and type')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached search responses and query the API again')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='Number of city/type pairs to collect at the same time')
     
     args = parser.parse_args()
     
@@ -194,22 +437,29 @@ def main():
         print("Error: Google Places API key not found. Please add it to your .env file.")
         return
     
-    # Validate the city exists
-    city = validate_city(args.city_slug)
-    if not city:
-        print(f"Error: City with slug '{args.city_slug}' not found. Please add it first using simple_city_fetcher.py.")
-        sys.exit(1)
+    # Validate the cities exist
+    cities = []
+    for city_slug in args.city_slug:
+        city = validate_city(city_slug)
+        if not city:
+            print(f"Error: City with slug '{city_slug}' not found. Please add it first using simple_city_fetcher.py.")
+            sys.exit(1)
+        cities.append(city)
     
-    print(f"Collecting data for {args.type} in {city['name']}, {city['state']}...")
-    places = collect_data(city, args.type, args.max)
+    for city in cities:
+        print(f"Collecting data for {', '.join(args.type)} in {city['name']}, {city['state']}...")
+    found, inserted, updated, failed = collect_many(cities, args.type, args.max,
+                                                    use_cache=not args.no_cache, max_workers=args.workers)
     
-    if places:
-        print(f"Found {len(places)} places. Saving to MongoDB...")
-        inserted, updated = save_data(places, args.city_slug, args.type)
-        
+    if found:
         print(f"Data collection complete! {inserted} new records, {updated} updated records.")
     else:
         print("No places found or error in API request.")
+    
+    if failed:
+        pairs = ', '.join(f"{place_type_slug} in {city_slug}" for city_slug, place_type_slug in failed)
+        print(f"Error: collection failed for {pairs}.")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+HTTP utilities for mental health resources data collection.
+This module provides shared HTTP sessions and rate limiting for the API clients.
+"""
+
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson decodes large responses several times faster; optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def create_session(headers=None, pool_maxsize=10, retries=0):
+    """
+    Create a requests session that keeps connections alive between calls.
+
+    Args:
+        headers (dict, optional): Default headers sent with every request.
+        pool_maxsize (int): Maximum number of pooled connections per host.
+        retries (int): Retries with exponential backoff on connection errors
+            and RETRY_STATUS_CODES, honouring Retry-After.
+
+    Returns:
+        requests.Session: Configured session.
+    """
+    session = requests.Session()
+    max_retries = Retry(
+        total=retries,
+        backoff_factor=0.3,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({'GET', 'POST'}),
+        raise_on_status=False  # Hand the last response back for raise_for_status
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount('https://', adapter)
+
+    if headers:
+        session.headers.update(headers)
+
+    return session
+
+def load_json(data):
+    """
+    Decode a JSON document.
+
+    Args:
+        data (bytes or str): Serialized JSON.
+
+    Returns:
+        Decoded JSON, parsed with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def parse_json(response):
+    """
+    Decode a JSON response body.
+
+    Args:
+        response (requests.Response): Response to decode.
+
+    Returns:
+        Decoded JSON, parsed with orjson when it is installed.
+    """
+    return load_json(response.content)
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting how often requests can be made.
+
+    Tokens refill at `rate` per second up to `capacity`; each call to
+    `acquire` takes one token, sleeping until one is available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            # Reserve the token now; callers queue up behind the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+            if wait:
+                time.sleep(wait)
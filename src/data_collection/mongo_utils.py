@@ -5,8 +5,13 @@ This module provides shared database functions for the data collection system.
 """
 
 import os
+import threading
 from datetime import datetime
-from pymongo import MongoClient
+from functools import lru_cache
+from itertools import islice
+from pymongo import MongoClient, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,14 +21,94 @@ load_dotenv()
 MONGO_CONNECTION_STRING = os.getenv('MONGO_CONNECTION_STRING', 'mongodb://localhost:27017/')
 MONGO_DATABASE = os.getenv('MONGO_DATABASE', 'mental_health_resources')
 
+# Wire compression for the large Google Place documents; zstd and snappy
+# need the zstandard / python-snappy packages, zlib is always available
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', 'zlib')
+
+# Connection pool sized for these CLI scripts rather than PyMongo's default
+# of 100: enough for the collector's worker threads, with a couple of warm
+# connections and fail-fast server selection
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '16'))
+
+# Number of places sent to MongoDB per bulk_write call
+WRITE_BATCH_SIZE = 1000
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Place data is re-fetchable from the APIs, so bulk writes only wait for the
+# primary to acknowledge instead of a replica set majority
+PLACES_WRITE_CONCERN = WriteConcern(w=1)
+
+# Number of documents fetched per cursor round-trip when reading places
+READ_BATCH_SIZE = 1000
+
+# Raw place fields that never change once stored, or that are written by
+# their own update operator, so they are left out of $set
+RAW_FIXED_FIELDS = frozenset({
+    'id', 'source', 'city_slug', 'city_id', 'city_name', 'state', 'state_code',
+    'categories', 'created_at'
+})
+
 # Collection names
 CITIES_COLLECTION = 'cities'
 RAW_PLACES_COLLECTION = 'raw_places'
 PROCESSED_PLACES_COLLECTION = 'processed_places'
 
+# Indexes for each collection, created once per process on first use
+COLLECTION_INDEXES = {
+    RAW_PLACES_COLLECTION: [
+        # Equality-first compound indexes: the upsert key in save_raw_places,
+        # and the source/city/category filter in get_raw_places and combine_data
+        IndexModel([("source", 1), ("id", 1)], name='src_id', unique=True),
+        IndexModel([("source", 1), ("city_slug", 1), ("categories", 1)], name='src_city_cat'),
+        IndexModel([("categories", 1)])
+    ],
+    PROCESSED_PLACES_COLLECTION: [
+        IndexModel([("city_slug", 1)]),
+        IndexModel([("categories", 1)]),
+        IndexModel([("source_id", 1)], sparse=True),
+        IndexModel([("location", "2dsphere")]),
+        # Unique hash makes combine_data re-runs idempotent; sparse so documents
+        # written without a hash (e.g. by --server-side) don't collide on null
+        IndexModel([("dedup_hash", 1)], unique=True, sparse=True)
+    ]
+}
+
+# Indexes from earlier versions that the compound indexes above replace
+OBSOLETE_INDEXES = {
+    RAW_PLACES_COLLECTION: ('id_1', 'source_1', 'city_slug_1', 'source_1_city_slug_1_category_1')
+}
+
+# Shared client; MongoClient is thread-safe and pools its own connections,
+# but must not be reused across fork, so remember which process created it
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Names of collections whose indexes were already created by this process
+_ensured = set()
+
 def get_mongo_client():
-    """Create and return a MongoDB client."""
-    return MongoClient(MONGO_CONNECTION_STRING)
+    """Return the shared MongoDB client, creating it on first use in each process."""
+    global _client, _client_pid
+    
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client_pid = os.getpid()
+            _client = MongoClient(
+                MONGO_CONNECTION_STRING,
+                compressors=MONGO_COMPRESSORS,
+                retryWrites=True,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=2,
+                maxConnecting=2,
+                maxIdleTimeMS=120000,
+                socketTimeoutMS=30000,
+                serverSelectionTimeoutMS=5000
+            )
+    
+    return _client
 
 def get_database():
     """Get the MongoDB database."""
@@ -39,23 +124,85 @@ def get_cities_collection():
     """Get the cities collection."""
     return get_collection(CITIES_COLLECTION)
 
+def ensure_indexes(collection):
+    """
+    Create the indexes for a collection, once per process.
+    
+    Args:
+        collection: The MongoDB collection.
+    """
+    if collection.name not in _ensured:
+        # One createIndexes command instead of a round-trip per index
+        collection.create_indexes(COLLECTION_INDEXES[collection.name])
+        
+        # Drop superseded indexes so writes don't keep maintaining them
+        existing = collection.index_information()
+        for name in OBSOLETE_INDEXES.get(collection.name, ()):
+            if name in existing:
+                collection.drop_index(name)
+        
+        _ensured.add(collection.name)
+
+def drop_collection(collection):
+    """Drop a collection; its indexes are recreated on next use."""
+    collection.drop()
+    _ensured.discard(collection.name)
+
 def get_raw_places_collection():
-    """Get the raw places collection."""
-    return get_collection(RAW_PLACES_COLLECTION)
+    """Get the raw places collection, creating its indexes on first use."""
+    collection = get_database().get_collection(RAW_PLACES_COLLECTION, write_concern=PLACES_WRITE_CONCERN)
+    ensure_indexes(collection)
+    return collection
 
 def get_processed_places_collection():
-    """Get the processed places collection."""
-    return get_collection(PROCESSED_PLACES_COLLECTION)
+    """Get the processed places collection, creating its indexes on first use."""
+    collection = get_database().get_collection(PROCESSED_PLACES_COLLECTION, write_concern=PLACES_WRITE_CONCERN)
+    ensure_indexes(collection)
+    return collection
 
+def bulk_write_unordered(collection, operations):
+    """
+    Send a batch of writes that the server may apply in any order.
+    
+    A duplicate key from two workers upserting the same place at once is
+    reported without losing the rest of the batch; any other failure raises
+    BulkWriteError.
+    
+    Args:
+        collection: The MongoDB collection.
+        operations (list): InsertOne/UpdateOne operations.
+        
+    Returns:
+        dict: Write counts (nInserted, nUpserted, nMatched, ...).
+    """
+    try:
+        return collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        
+        # Anything but a duplicate key, including a write concern failure,
+        # means the batch wasn't saved as asked
+        if (not errors or e.details.get('writeConcernErrors')
+                or any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors)):
+            raise
+        
+        print(f"Warning: {len(errors)} of {len(operations)} writes hit a duplicate key: {errors[0].get('errmsg', '')}")
+        return e.details
+
+@lru_cache(maxsize=256)
 def validate_city(city_slug):
     """
     Validate that a city exists in the database.
     
+    Results are cached per process, since save_raw_places looks the city up
+    for every page; call validate_city.cache_clear() after adding a city.
+    
     Args:
         city_slug (str): The city slug to validate.
         
     Returns:
-        dict: The city document if found, None otherwise.
+        dict: The city document if found, None otherwise. The document is
+            shared between callers and must not be modified.
     """
     cities_collection = get_cities_collection()
     return cities_collection.find_one({"slug": city_slug})
@@ -66,7 +213,8 @@ def save_raw_places(places, source, city_slug, category):
     If a place with the same ID already exists, add the new category to its categories.
     
     Args:
-        places (list): List of place dictionaries.
+        places (iterable): Place dictionaries, consumed in batches so a
+            generator can be streamed straight in.
         source (str): The data source (always 'google').
         city_slug (str): The city slug.
         category (str): The category of places.
@@ -81,67 +229,65 @@ def save_raw_places(places, source, city_slug, category):
     
     collection = get_raw_places_collection()
     
-    # Set up indexes if they don't exist
-    collection.create_index([("source", 1)])
-    collection.create_index([("city_slug", 1)])
-    collection.create_index([("categories", 1)])
-    collection.create_index([("id", 1)], sparse=True)
-    
     inserted_count = 0
     updated_count = 0
     
-    for place in places:
-        # Add metadata
-        place['source'] = source
-        place['city_slug'] = city_slug
-        place['city_id'] = city['_id']
-        place['city_name'] = city['name']
-        place['state'] = city['state']
-        place['state_code'] = city['state_code']
-        
-        # Ensure place has a categories array with the current category
-        if 'categories' not in place:
-            place['categories'] = [category]
-            
-        place['updated_at'] = datetime.now()
-        
-        # Define the query to find existing place
-        query = {'source': 'google', 'id': place['id']}
-        
-        # Check if the place already exists
-        existing_place = collection.find_one(query)
+    # One timestamp for every place saved in this call
+    now = datetime.now()
+    
+    # Metadata only written when a place is first inserted
+    metadata = {
+        'source': source,
+        'city_slug': city_slug,
+        'city_id': city['_id'],
+        'city_name': city['name'],
+        'state': city['state'],
+        'state_code': city.get('state_code'),
+        'created_at': now
+    }
+    
+    places = iter(places)
+    while True:
+        batch = list(islice(places, WRITE_BATCH_SIZE))
+        if not batch:
+            break
         
-        if existing_place:
-            # Place exists, update it and append the category if not already present
-            existing_categories = existing_place.get('categories', [])
+        operations = []
+        for place in batch:
+            # Ensure the current category is stored; MongoDB merges it into
+            # the categories of an existing place without a read first
+            categories = place.get('categories') or [category]
             
-            # Add the new category if it's not already in the list
-            if category not in existing_categories:
-                existing_categories.append(category)
+            # Only the Google payload and timestamp can change between runs
+            fields = {key: value for key, value in place.items() if key not in RAW_FIXED_FIELDS}
+            fields['updated_at'] = now
             
-            # Update the place with merged categories
-            place['categories'] = existing_categories
-            
-            # Update the document
-            result = collection.update_one(query, {'$set': place})
-            updated_count += 1
-        else:
-            # Place doesn't exist, insert it
-            result = collection.insert_one(place)
-            inserted_count += 1
+            # Update the place if it exists, insert it otherwise
+            query = {'source': 'google', 'id': place['id']}
+            operations.append(UpdateOne(query, {
+                '$set': fields,
+                '$addToSet': {'categories': {'$each': categories}},
+                '$setOnInsert': metadata
+            }, upsert=True))
+        
+        result = bulk_write_unordered(collection, operations)
+        inserted_count += result['nUpserted']
+        updated_count += result['nMatched']
     
     return inserted_count, updated_count
 
-def get_raw_places(city_slug=None, category=None):
+def iter_raw_places(city_slug=None, category=None, projection=None, batch_size=READ_BATCH_SIZE):
     """
-    Get raw places data from MongoDB with optional filtering.
+    Iterate over raw places in MongoDB with optional filtering.
     
     Args:
         city_slug (str, optional): Filter by city slug.
         category (str, optional): Filter by category.
+        projection (dict, optional): Fields to return; all fields by default.
+        batch_size (int): Documents fetched per round-trip.
         
-    Returns:
-        list: List of place dictionaries.
+    Yields:
+        dict: Place documents, streamed from the server.
     """
     collection = get_raw_places_collection()
     
@@ -152,93 +298,107 @@ def get_raw_places(city_slug=None, category=None):
         # Filter by category in the categories array
         query['categories'] = category
     
-    return list(collection.find(query))
+    yield from collection.find(query, projection).batch_size(batch_size)
+
+def get_raw_places(city_slug=None, category=None):
+    """
+    Get raw places data from MongoDB with optional filtering.
+    
+    Args:
+        city_slug (str, optional): Filter by city slug.
+        category (str, optional): Filter by category.
+        
+    Returns:
+        list: List of place dictionaries.
+    """
+    return list(iter_raw_places(city_slug, category))
 
-def save_processed_places(places, replace=False):
+def save_processed_places(places, replace=False, replace_filter=None):
     """
     Save processed place data to MongoDB.
     
     Args:
         places (list): List of processed place dictionaries.
         replace (bool): Whether to replace the existing collection.
+        replace_filter (dict, optional): Only delete the matching places
+            before saving, keeping the collection and its indexes.
         
     Returns:
         tuple: (inserted_count, updated_count)
     """
-    collection = get_processed_places_collection()
-    
-    # Set up indexes if they don't exist
-    collection.create_index([("city_slug", 1)])
-    collection.create_index([("categories", 1)])
-    collection.create_index([("source_id", 1)], sparse=True)
-    collection.create_index([("location", "2dsphere")])
-    
     # If replace flag is set, drop the collection first
     if replace:
-        collection.drop()
-        # Recreate indexes
-        collection.create_index([("city_slug", 1)])
-        collection.create_index([("categories", 1)])
-        collection.create_index([("source_id", 1)], sparse=True)
-        collection.create_index([("location", "2dsphere")])
+        drop_collection(get_collection(PROCESSED_PLACES_COLLECTION))
+    
+    collection = get_processed_places_collection()
+    
+    if replace_filter:
+        collection.delete_many(replace_filter)
     
     inserted_count = 0
     updated_count = 0
     
-    for place in places:
-        # Add updated timestamp
-        place['updated_at'] = datetime.now()
-        
-        # Build query to find existing place
-        query = {}
-        if 'source_id' in place and place['source_id']:
-            query = {"source_id": place['source_id']}
-        
-        if not query and 'city_slug' in place and 'name' in place:
-            # If no source ID, try to match by name and city
-            query = {
-                "city_slug": place['city_slug'],
-                "name": place['name']
-            }
-        
-        if not query:
-            # If no query can be built, just insert
-            result = collection.insert_one(place)
-            inserted_count += 1
-            continue
-        
-        # Check if document exists to handle categories properly
-        existing_place = collection.find_one(query)
-        if existing_place and 'categories' in place and 'categories' in existing_place:
-            # Merge categories from existing and new place
-            all_categories = set(existing_place['categories'])
-            all_categories.update(place['categories'])
-            place['categories'] = list(all_categories)
-        
-        # Update or insert the document
-        result = collection.update_one(
-            query,
-            {'$set': place},
-            upsert=True
-        )
-        
-        if result.matched_count > 0:
-            updated_count += 1
-        else:
-            inserted_count += 1
+    # One timestamp for every place saved in this call
+    now = datetime.now()
+    
+    places = iter(places)
+    while True:
+        batch = list(islice(places, WRITE_BATCH_SIZE))
+        if not batch:
+            break
+        
+        operations = []
+        for place in batch:
+            # Add updated timestamp
+            place['updated_at'] = now
+            
+            # Build query to find existing place
+            query = {}
+            if 'source_id' in place and place['source_id']:
+                query = {"source_id": place['source_id']}
+            
+            if not query and 'city_slug' in place and 'name' in place:
+                # If no source ID, try to match by name and city
+                query = {
+                    "city_slug": place['city_slug'],
+                    "name": place['name']
+                }
+            
+            if not query:
+                # If no query can be built, just insert
+                operations.append(InsertOne(place))
+                continue
+            
+            update = {'$set': place}
+            if isinstance(place.get('categories'), list):
+                # Let MongoDB merge categories with those of an existing place;
+                # a comma-joined string (as from combine_data) is just set
+                update = {
+                    '$set': {key: value for key, value in place.items() if key != 'categories'},
+                    '$addToSet': {'categories': {'$each': place['categories']}}
+                }
+            
+            # Update or insert the document
+            operations.append(UpdateOne(query, update, upsert=True))
+        
+        result = bulk_write_unordered(collection, operations)
+        inserted_count += result['nInserted'] + result['nUpserted']
+        updated_count += result['nMatched']
     
     return inserted_count, updated_count
 
-def get_processed_places(city_slug=None, category=None):
+def iter_processed_places(city_slug=None, category=None, projection=None, batch_size=READ_BATCH_SIZE):
     """
-    Get processed places data from MongoDB with optional filtering.
+    Iterate over processed places in MongoDB with optional filtering.
     
     Args:
         city_slug (str, optional): Filter by city slug.
         category (str, optional): Filter by category.
+        projection (dict, optional): Fields to return; all fields by default.
+        batch_size (int): Documents fetched per round-trip.
         
-    Returns:
-        list: List of place dictionaries.
+    Yields:
+        dict: Place documents, streamed from the server.
     """
     collection = get_processed_places_collection()
     
@@ -249,4 +409,17 @@ def get_processed_places(city_slug=None, category=None):
         # Updated to search in the categories array
         query['categories'] = category
     
-    return list(collection.find(query)) 
\ No newline at end of file
+    yield from collection.find(query, projection).batch_size(batch_size)
+
+def get_processed_places(city_slug=None, category=None):
+    """
+    Get processed places data from MongoDB with optional filtering.
+    
+    Args:
+        city_slug (str, optional): Filter by city slug.
+        category (str, optional): Filter by category.
+        
+    Returns:
+        list: List of place dictionaries.
+    """
+    return list(iter_processed_places(city_slug, category))
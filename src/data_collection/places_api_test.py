@@ -7,10 +7,14 @@ import os
 import json
 import requests
 from dotenv import load_dotenv
+from http_utils import create_session, parse_json
 
 # Load environment variables
 load_dotenv()
 
+# Shared session, retrying rate-limited and transient failures
+SESSION = create_session(retries=3)
+
 def search_places(query, api_key):
     """
     Search for places using the Places API v1 endpoint
@@ -30,14 +34,15 @@ def search_places(query, api_key):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = SESSION.post(url, headers=headers, json=data)
         response.raise_for_status()  # Raise an exception for bad status codes
+        result = parse_json(response)
         
         # Print the response in a formatted way
         print("\nResponse:")
-        print(json.dumps(response.json(), indent=2))
+        print(json.dumps(result, indent=2))
         
-        return response.json()
+        return result
         
     except requests.exceptions.RequestException as e:
         print(f"Error making request: {e}")
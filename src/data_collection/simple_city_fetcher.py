@@ -4,41 +4,31 @@ Simple City Fetcher
 Adds a city to MongoDB just using city name and country.
 """
 
-import os
 import sys
 import argparse
 import requests
-import time
 import re
 from dotenv import load_dotenv
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import GEOSPHERE
 from datetime import datetime
+from http_utils import create_session, parse_json, RateLimiter
+from mongo_utils import get_cities_collection, validate_city
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB connection settings
-MONGO_CONNECTION_STRING = os.getenv('MONGO_CONNECTION_STRING', 'mongodb://localhost:27017/')
-MONGO_DATABASE = os.getenv('MONGO_DATABASE', 'mental_health_resources')
-CITIES_COLLECTION = 'cities'
-
 # Nominatim API settings
 NOMINATIM_BASE_URL = "https://nominatim.openstreetmap.org/search"
 USER_AGENT = "MentalHealthResourcesWebsite/1.0"
 
-def get_mongo_client():
-    """Create and return a MongoDB client."""
-    return MongoClient(MONGO_CONNECTION_STRING)
+# Shared session so repeated lookups reuse the same connection
+SESSION = create_session(headers={"User-Agent": USER_AGENT})  # User-Agent required by Nominatim API
 
-def get_database():
-    """Get the MongoDB database."""
-    client = get_mongo_client()
-    return client[MONGO_DATABASE]
+# Respect Nominatim usage policy - max 1 request per second, shared across threads
+NOMINATIM_RATE_LIMITER = RateLimiter(rate=1)
 
-def get_cities_collection():
-    """Get the cities collection."""
-    db = get_database()
-    return db[CITIES_COLLECTION]
+# State code from Nominatim's ISO 3166-2 subdivision, e.g. "US-NY" -> "NY"
+STATE_CODE_RE = re.compile(r'^[A-Z]{2}-([A-Z0-9]{1,3})$')
 
 def setup_collection():
     """Set up the cities collection with indexes."""
@@ -71,15 +61,12 @@ def fetch_and_add_city(city_name, country="USA"):
         "addressdetails": 1
     }
     
-    headers = {
-        "User-Agent": USER_AGENT  # Required by Nominatim API
-    }
-    
     try:
         print(f"Fetching data for {city_name}, {country}...")
-        response = requests.get(NOMINATIM_BASE_URL, params=params, headers=headers)
+        NOMINATIM_RATE_LIMITER.acquire()
+        response = SESSION.get(NOMINATIM_BASE_URL, params=params)
         response.raise_for_status()
-        results = response.json()
+        results = parse_json(response)
         
         if not results:
             return False, f"No results found for {city_name}, {country}", None
@@ -90,6 +77,8 @@ def fetch_and_add_city(city_name, country="USA"):
         
         # Extract state information
         state_name = address.get('state')
+        state_match = STATE_CODE_RE.match(address.get('ISO3166-2-lvl4', ''))
+        state_code = state_match.group(1) if state_match else None
 
         # Create a slug - simplified to only use city name
         slug = city_name.lower().replace(' ', '-')
@@ -105,6 +94,7 @@ def fetch_and_add_city(city_name, country="USA"):
             "name": city_name,
             "slug": slug,
             "state": state_name,
+            "state_code": state_code,
             "country": country,
             "location": {
                 "type": "Point",
@@ -116,6 +106,9 @@ def fetch_and_add_city(city_name, country="USA"):
         
         # Add to MongoDB
         result = collection.insert_one(city)
+        
+        # Forget any earlier "not found" lookup for this slug
+        validate_city.cache_clear()
         return True, f"City '{city_name}, {country}' added with ID: {result.inserted_id}", slug
         
     except requests.exceptions.RequestException as e: